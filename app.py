@@ -3,13 +3,24 @@ import requests
 import os
 import json
 import uuid
+import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 from pathlib import Path
-import boto3
-from botocore.exceptions import ClientError
+import streamlit.components.v1 as components
+from botocore.exceptions import BotoCoreError, ClientError
 from dotenv import load_dotenv
 import ast
-import pymysql
+from file_registry import (
+    DATA_DIR, DATA_STORE, DEFAULT_ORG_ID, DEFAULT_TAG_ID, DEFAULT_USER_ID,
+    DELETE_FILE_API, DIRECT_UPLOAD_URL_EXPIRATION, INSIGHT_JOBS_FILE, INSIGHTS_MAX_TIMEOUT,
+    RECONCILE_STATE_FILE, S3_BUCKET_NAME, S3_UPLOAD_PREFIX, get_db_connection,
+    insert_file, new_s3_client
+)
+import sqlite3
+import gzip
 
 # Create data directory
 os.makedirs("data", exist_ok=True)
@@ -32,28 +43,65 @@ st.set_page_config(
 # ------------------------------
 API_GET_INSIGHTS = os.getenv("GET_INSIGHTS_URL", "https://your-api-endpoint.com/get-insights")
 CHAT_API = os.getenv("GET_ANSWER_URL", "https://your-api-endpoint.com/chat")
-DELETE_FILE_API = os.getenv("DELETE_FILE_URL", "https://your-api-endpoint.com/delete-files")
-DATA_DIR = "data"
-DATA_STORE = f"{DATA_DIR}/uploaded_files.json"
 CHAT_HISTORY_FILE = f"{DATA_DIR}/chat_history.json"
 SESSION_DATA_FILE = f"{DATA_DIR}/session_data.json"
+CHAT_INDEX_DB = f"{DATA_DIR}/chat_index.db"
+CHAT_SEARCH_LIMIT = 20
+
+# Parallel per-document chat (fan-out) configuration
+CHAT_FANOUT_SHARD_SIZE = max(1, int(os.getenv("CHAT_FANOUT_SHARD_SIZE", "1")))
+CHAT_FANOUT_MAX_WORKERS = max(1, int(os.getenv("CHAT_FANOUT_MAX_WORKERS", "4")))
 
-# S3 Configuration
-S3_BUCKET_NAME = "intel-repo"
-AWS_REGION = os.getenv("AWS_REGION", "us-east-1")
-AWS_ACCESS_KEY_ID = os.getenv("AWS_ACCESS_KEY_ID")
-AWS_SECRET_ACCESS_KEY = os.getenv("AWS_SECRET_ACCESS_KEY")
+# Prefetch when the document selection changes
+PREFETCH_ENABLED = os.getenv("PREFETCH_ENABLED", "true").lower() == "true"
+PREFETCH_TIMEOUT = 10
+HTTP_POOL_SIZE = 10
+FIRST_QUERY_METRIC_WINDOW = 100
+
+# Raw chat response archive (gzip-framed segments with a SQLite offset index)
+RAW_ARCHIVE_DIR = f"{DATA_DIR}/raw_responses"
+RAW_ARCHIVE_INDEX = f"{RAW_ARCHIVE_DIR}/index.db"
+RAW_ARCHIVE_SEGMENT_BYTES = int(os.getenv("RAW_ARCHIVE_SEGMENT_BYTES", str(16 * 1024 * 1024)))
+RAW_ARCHIVE_MAX_BYTES = int(os.getenv("RAW_ARCHIVE_MAX_BYTES", str(512 * 1024 * 1024)))
 
 # Presigned URL expiration time (in seconds)
 PRESIGNED_URL_EXPIRATION = 3600
 
+# Upload mode: "server" streams through the app, "direct" uploads browser -> S3
+UPLOAD_MODE = os.getenv("UPLOAD_MODE", "server")
+DIRECT_UPLOAD_MAX_BYTES = int(os.getenv("DIRECT_UPLOAD_MAX_BYTES", str(200 * 1024 * 1024)))
+
 # Default configuration
-DEFAULT_USER_ID = 101
-DEFAULT_ORG_ID = 101
-DEFAULT_TAG_ID = 123
 DEFAULT_CLIENT_ID = str(uuid.uuid4())
 DEFAULT_CONNECTION_ID = str(uuid.uuid4())
-DEFAULT_CI_ORG_GUID = "880f867a-1168-4905-a3bc-30257f2cc91f"
+
+# Circuit breaker configuration (per backend endpoint)
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_ERROR_RATE_THRESHOLD = float(os.getenv("CIRCUIT_ERROR_RATE_THRESHOLD", "0.5"))
+CIRCUIT_WINDOW_SIZE = 20
+CIRCUIT_RESET_TIMEOUT = int(os.getenv("CIRCUIT_RESET_TIMEOUT", "30"))
+
+# Adaptive timeouts: upper bound per endpoint (the old fixed values)
+ENDPOINT_MAX_TIMEOUTS = {
+    "get_insights": INSIGHTS_MAX_TIMEOUT,
+    "chat": 520,
+    "delete_files": 220
+}
+# Lower bound per endpoint. Insight latency grows with document size, so a
+# run of small documents must not shrink the timeout below a large one's.
+ENDPOINT_MIN_TIMEOUTS = {
+    "get_insights": 300,
+    "chat": 30,
+    "delete_files": 10
+}
+TIMEOUT_PERCENTILE = 0.95
+TIMEOUT_MULTIPLIER = 2.0
+TIMEOUT_MIN_SAMPLES = 10
+TIMEOUT_LATENCY_WINDOW = 100
+
+# Insight retry configuration
+INSIGHT_MAX_RETRIES = int(os.getenv("INSIGHT_MAX_RETRIES", "3"))
+INSIGHT_PROCESS_ID_KEYS = ["retry_process_id", "failed_process_ids", "process_ids", "process_id"]
 
 # ------------------------------
 # CUSTOM CSS
@@ -140,29 +188,192 @@ if "session_id" not in st.session_state:
     st.session_state.session_id = 0
 if "chat_counter" not in st.session_state:
     st.session_state.chat_counter = 0
+# Questions asked; chat_counter counts backend chat turns, which a fan-out
+# question uses one of per shard
+if "message_counter" not in st.session_state:
+    st.session_state.message_counter = 0
 if "client_id" not in st.session_state:
     st.session_state.client_id = DEFAULT_CLIENT_ID
 if "connection_id" not in st.session_state:
     st.session_state.connection_id = DEFAULT_CONNECTION_ID
 if "uploaded_file_key" not in st.session_state:
     st.session_state.uploaded_file_key = 0
+if "direct_upload" not in st.session_state:
+    st.session_state.direct_upload = None
+if "prefetched_file_ids" not in st.session_state:
+    st.session_state.prefetched_file_ids = []
+if "prefetch_future" not in st.session_state:
+    st.session_state.prefetch_future = None
+if "first_query_pending" not in st.session_state:
+    st.session_state.first_query_pending = False
 
 # ------------------------------
 # S3 CLIENT
 # ------------------------------
+@st.cache_resource
+def create_s3_client():
+    """Shared S3 client, so its connection pool stays warm between calls."""
+    return new_s3_client()
+
 def get_s3_client():
     """Initialize and return S3 client."""
     try:
-        return boto3.client(
-            's3',
-            region_name=AWS_REGION,
-            aws_access_key_id=AWS_ACCESS_KEY_ID,
-            aws_secret_access_key=AWS_SECRET_ACCESS_KEY
-        )
+        return create_s3_client()
     except Exception as e:
         st.error(f"Failed to initialize S3 client: {e}")
         return None
 
+# ------------------------------
+# CIRCUIT BREAKERS
+# ------------------------------
+class CircuitOpenError(Exception):
+    """Raised when an endpoint's circuit is open and the call is skipped."""
+
+class EndpointCircuit:
+    """Circuit breaker and latency tracker for a single backend endpoint.
+
+    Trips to "open" on consecutive failures or a high error rate over the
+    recent window, fails fast while open, and lets one probe through once
+    the reset timeout has elapsed ("half_open").
+    """
+
+    def __init__(self, name, min_timeout, max_timeout):
+        self.name = name
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.probe_in_flight = False
+        self.outcomes = deque(maxlen=CIRCUIT_WINDOW_SIZE)
+        self.latencies = deque(maxlen=TIMEOUT_LATENCY_WINDOW)
+        self.lock = threading.Lock()
+
+    def allow_request(self):
+        """Return True if a call may go through right now."""
+        with self.lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open":
+                if time.monotonic() - self.opened_at < CIRCUIT_RESET_TIMEOUT:
+                    return False
+                self.state = "half_open"
+            # Half-open: only a single probe at a time
+            if self.probe_in_flight:
+                return False
+            self.probe_in_flight = True
+            return True
+
+    def record_success(self, latency):
+        """Record a successful call and close the circuit."""
+        with self.lock:
+            self.latencies.append(latency)
+            if self.state == "half_open":
+                # Recovered: start the error-rate window afresh
+                self.outcomes.clear()
+            self.outcomes.append(True)
+            self.consecutive_failures = 0
+            self.probe_in_flight = False
+            self.state = "closed"
+            self.opened_at = None
+
+    def record_failure(self):
+        """Record a failed call and trip the circuit if thresholds are hit.
+        
+        Failures don't feed the latency window: fast 5xx or connection
+        errors would otherwise shrink the timeout below healthy latency.
+        """
+        with self.lock:
+            self.outcomes.append(False)
+            self.consecutive_failures += 1
+            self.probe_in_flight = False
+            if self.state == "half_open" or self._should_trip():
+                self.state = "open"
+                self.opened_at = time.monotonic()
+
+    def _should_trip(self):
+        if self.consecutive_failures >= CIRCUIT_FAILURE_THRESHOLD:
+            return True
+        if len(self.outcomes) < CIRCUIT_WINDOW_SIZE // 2:
+            return False
+        return self._error_rate() >= CIRCUIT_ERROR_RATE_THRESHOLD
+
+    def _error_rate(self):
+        if not self.outcomes:
+            return 0.0
+        return self.outcomes.count(False) / len(self.outcomes)
+
+    def current_timeout(self):
+        """Timeout derived from observed latency, within the endpoint's bounds."""
+        with self.lock:
+            if len(self.latencies) < TIMEOUT_MIN_SAMPLES:
+                return self.max_timeout
+            ordered = sorted(self.latencies)
+            index = min(len(ordered) - 1, int(len(ordered) * TIMEOUT_PERCENTILE))
+            timeout = ordered[index] * TIMEOUT_MULTIPLIER
+        return round(max(self.min_timeout, min(self.max_timeout, timeout)), 1)
+
+    def retry_after(self):
+        """Seconds until an open circuit allows a probe."""
+        with self.lock:
+            if self.state != "open":
+                return 0
+            return max(0, int(CIRCUIT_RESET_TIMEOUT - (time.monotonic() - self.opened_at)))
+
+    def snapshot(self):
+        """Return circuit state for the debug panel."""
+        timeout = self.current_timeout()
+        retry_after = self.retry_after()
+        with self.lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self.consecutive_failures,
+                "error_rate": round(self._error_rate(), 2),
+                "window_calls": len(self.outcomes),
+                "latency_samples": len(self.latencies),
+                "current_timeout": timeout,
+                "retry_after": retry_after
+            }
+
+@st.cache_resource
+def get_http_session():
+    """Shared HTTP session so backend connections are pooled and kept alive."""
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=HTTP_POOL_SIZE)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+@st.cache_resource
+def get_circuit_breakers():
+    """Circuit breakers shared across all sessions of this server."""
+    return {
+        name: EndpointCircuit(name, ENDPOINT_MIN_TIMEOUTS[name], max_timeout)
+        for name, max_timeout in ENDPOINT_MAX_TIMEOUTS.items()
+    }
+
+def post_with_circuit(endpoint, url, payload):
+    """POST through the endpoint's circuit breaker with an adaptive timeout."""
+    circuit = get_circuit_breakers()[endpoint]
+    if not circuit.allow_request():
+        raise CircuitOpenError(
+            f"Backend {endpoint} endpoint is unavailable, retry in {circuit.retry_after()}s"
+        )
+    
+    start = time.monotonic()
+    try:
+        response = get_http_session().post(url, json=payload, timeout=circuit.current_timeout())
+    except Exception:
+        circuit.record_failure()
+        raise
+    
+    elapsed = time.monotonic() - start
+    if response.status_code >= 500:
+        circuit.record_failure()
+    else:
+        circuit.record_success(elapsed)
+    return response
+
 # ------------------------------
 # UTILITY FUNCTIONS
 # ------------------------------
@@ -253,6 +464,33 @@ def save_session_data(data):
         st.error(f"Error saving session data: {e}")
         print(f"[DEBUG] Error saving session data: {e}")
 
+def load_insight_jobs():
+    """Load failed/partial insight jobs keyed by file_id."""
+    try:
+        if os.path.exists(INSIGHT_JOBS_FILE):
+            with open(INSIGHT_JOBS_FILE, "r") as f:
+                jobs = json.load(f)
+                print(f"[DEBUG] Loaded {len(jobs)} insight jobs from {INSIGHT_JOBS_FILE}")
+                return jobs
+    except json.JSONDecodeError as e:
+        st.error(f"Error parsing insight jobs: {e}")
+        print(f"[DEBUG] JSON decode error in insight jobs: {e}")
+    except Exception as e:
+        st.error(f"Error loading insight jobs: {e}")
+        print(f"[DEBUG] Error loading insight jobs: {e}")
+    return {}
+
+def save_insight_jobs(jobs):
+    """Save failed/partial insight jobs."""
+    try:
+        os.makedirs(os.path.dirname(INSIGHT_JOBS_FILE), exist_ok=True)
+        with open(INSIGHT_JOBS_FILE, "w") as f:
+            json.dump(jobs, f, indent=4)
+        print(f"[DEBUG] Saved {len(jobs)} insight jobs to {INSIGHT_JOBS_FILE}")
+    except Exception as e:
+        st.error(f"Error saving insight jobs: {e}")
+        print(f"[DEBUG] Error saving insight jobs: {e}")
+
 def create_new_session():
     """Create a new session with incremented session_id."""
     session_data = load_session_data()
@@ -262,6 +500,7 @@ def create_new_session():
     
     st.session_state.session_id = new_session_id
     st.session_state.chat_counter = 0
+    st.session_state.message_counter = 0
     st.session_state.chat_history = []
     st.session_state.client_id = str(uuid.uuid4())
     st.session_state.connection_id = str(uuid.uuid4())
@@ -277,6 +516,11 @@ def format_file_size(size_bytes):
         size_bytes /= 1024.0
     return f"{size_bytes:.1f} TB"
 
+def build_s3_key(file_name):
+    """Build the S3 key for a new upload."""
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    return f"{S3_UPLOAD_PREFIX}{timestamp}_{file_name}"
+
 def upload_file_to_s3(file_obj, file_name):
     """Upload file to S3 bucket and return S3 key."""
     s3_client = get_s3_client()
@@ -284,8 +528,7 @@ def upload_file_to_s3(file_obj, file_name):
         return None, "S3 client initialization failed"
     
     try:
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        s3_key = f"uploads/{timestamp}_{file_name}"
+        s3_key = build_s3_key(file_name)
         
         s3_client.upload_fileobj(
             file_obj,
@@ -300,6 +543,86 @@ def upload_file_to_s3(file_obj, file_name):
     except Exception as e:
         return None, f"Unexpected upload error: {str(e)}"
 
+def generate_presigned_post(key_prefix, expiration=DIRECT_UPLOAD_URL_EXPIRATION):
+    """Generate a presigned POST letting the browser upload under key_prefix."""
+    s3_client = get_s3_client()
+    if not s3_client:
+        return None
+    
+    try:
+        # S3 substitutes ${filename} with the name of the file the browser sends
+        return s3_client.generate_presigned_post(
+            S3_BUCKET_NAME,
+            key_prefix + "${filename}",
+            Fields={"Content-Type": "application/octet-stream"},
+            Conditions=[
+                ["starts-with", "$key", key_prefix],
+                {"Content-Type": "application/octet-stream"},
+                ["content-length-range", 1, DIRECT_UPLOAD_MAX_BYTES]
+            ],
+            ExpiresIn=expiration
+        )
+    except ClientError as e:
+        st.error(f"Error generating presigned POST: {e}")
+        return None
+
+def find_direct_uploads(key_prefix):
+    """Return the objects uploaded under key_prefix, newest first."""
+    s3_client = get_s3_client()
+    if not s3_client:
+        return []
+    
+    try:
+        paginator = s3_client.get_paginator("list_objects_v2")
+        contents = [
+            obj
+            for page in paginator.paginate(Bucket=S3_BUCKET_NAME, Prefix=key_prefix)
+            for obj in page.get("Contents", [])
+        ]
+        return sorted(contents, key=lambda obj: obj["LastModified"], reverse=True)
+    except ClientError as e:
+        st.error(f"Error checking S3 upload: {e}")
+        return []
+
+def render_direct_upload_widget(presigned_post):
+    """Render a file picker that POSTs straight from the browser to S3."""
+    components.html(f"""
+        <div style="font-family: sans-serif; font-size: 0.9rem;">
+            <input type="file" id="file" accept=".pdf,.docx">
+            <button id="upload" style="margin-top: 0.5rem;">Upload to S3</button>
+            <div id="status" style="margin-top: 0.5rem; color: #666;"></div>
+        </div>
+        <script>
+        const presigned = {json.dumps(presigned_post)};
+        const status = document.getElementById("status");
+        document.getElementById("upload").onclick = async () => {{
+            const file = document.getElementById("file").files[0];
+            if (!file || !/\\.(pdf|docx)$/i.test(file.name)) {{
+                status.textContent = "Choose a PDF or DOCX file first.";
+                return;
+            }}
+            const form = new FormData();
+            for (const [key, value] of Object.entries(presigned.fields)) {{
+                form.append(key, value);
+            }}
+            form.append("file", file);
+            status.textContent = "Uploading...";
+            try {{
+                const response = await fetch(presigned.url, {{method: "POST", body: form}});
+                if (response.ok) {{
+                    status.textContent = "Uploaded. Click 'Register Upload' to continue.";
+                }} else if (response.status === 403) {{
+                    status.textContent = "Upload link expired. Refresh the page and upload again.";
+                }} else {{
+                    status.textContent = "Upload failed (" + response.status + ").";
+                }}
+            }} catch (e) {{
+                status.textContent = "Upload failed: " + e;
+            }}
+        }};
+        </script>
+    """, height=120)
+
 def generate_presigned_url(s3_key, expiration=PRESIGNED_URL_EXPIRATION):
     """Generate presigned URL for S3 object."""
     s3_client = get_s3_client()
@@ -333,17 +656,6 @@ def delete_file_from_s3(s3_key):
         st.error(f"Error deleting file from S3: {e}")
         return False
 
-def get_db_connection():
-    """Create database connection."""
-    return pymysql.connect(
-        host=os.getenv("DB_HOST"),
-        user=os.getenv("DB_USER"),
-        password=os.getenv("DB_PASSWORD"),
-        database=os.getenv("DB_NAME"),
-        cursorclass=pymysql.cursors.DictCursor,
-        autocommit=False
-    )
-
 def store_uploaded_file_in_db(file_info):
     """Store file metadata in database."""
     conn = None
@@ -351,36 +663,8 @@ def store_uploaded_file_in_db(file_info):
         conn = get_db_connection()
         cursor = conn.cursor()
         
-        # Insert into files table
-        sql_files = """
-            INSERT INTO files 
-                (name, user_id, upload_state, file_size,
-                 ci_file_guid, ci_org_guid, type, status,
-                 is_contract, is_template)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-        """
-        cursor.execute(sql_files, (
-            file_info["file_name"],
-            file_info["user_id"],
-            3,
-            file_info["file_size"],
-            file_info["file_id"],
-            DEFAULT_CI_ORG_GUID,
-            1,
-            1,
-            1,
-            0
-        ))
-        
-        # Insert into file_tags table
-        sql_tags = """
-            INSERT INTO file_tags (file_temp_id, tag_id)
-            VALUES (%s, %s)
-        """
-        cursor.execute(sql_tags, (
-            file_info["file_id"], 
-            DEFAULT_TAG_ID
-        ))
+        # Insert into files and file_tags tables
+        insert_file(cursor, file_info)
         
         conn.commit()
         return True, file_info["file_id"]
@@ -405,11 +689,13 @@ def remove_vectors_from_db(file_id):
             "file_ids": [file_id]
         }
         
-        response = requests.post(DELETE_FILE_API, json=payload, timeout=220)
+        response = post_with_circuit("delete_files", DELETE_FILE_API, payload)
         if response.status_code == 200:
             return True, "Vectors removed successfully"
         else:
             return False, f"API returned status {response.status_code}: {response.text}"
+    except CircuitOpenError as e:
+        return False, str(e)
     except Exception as e:
         return False, f"Unexpected error: {str(e)}"
 
@@ -442,8 +728,31 @@ def delete_file_from_db(file_id):
             except:
                 pass
 
-def trigger_get_insights(file_info):
-    """Trigger the get-insights API."""
+def extract_process_ids(response):
+    """Pull resumable process IDs out of a get-insights response, if present."""
+    try:
+        data = response.json()
+    except ValueError:
+        return []
+    if not isinstance(data, dict):
+        return []
+    if isinstance(data.get("data"), dict):
+        data = {**data, **data["data"]}
+    
+    for key in INSIGHT_PROCESS_ID_KEYS:
+        ids = data.get(key)
+        if isinstance(ids, list) and ids:
+            return ids
+        if ids not in (None, "", []):
+            return [ids]
+    return []
+
+def trigger_get_insights(file_info, retry_no=0, retry_process_id=None):
+    """Trigger the get-insights API. Returns (success, message, process_ids).
+    
+    process_ids is None when the request never reached the backend (open
+    circuit or failed connection), so callers don't count it as an attempt.
+    """
     payload = {
         "file_id": file_info["file_id"],
         "file_name": file_info["file_name"],
@@ -451,32 +760,154 @@ def trigger_get_insights(file_info):
         "user_id": file_info.get("user_id", DEFAULT_USER_ID),
         "org_id": file_info.get("org_id", DEFAULT_ORG_ID),
         "url": file_info["presigned_url"],
-        "retry_no": 0,
-        "retry_process_id": [0],
+        "retry_no": retry_no,
+        "retry_process_id": retry_process_id or [0],
         "target_metadata_fields": ["string"],
         "tag_ids": [file_info.get("tag_id", DEFAULT_TAG_ID)]
     }
     
     try:
-        response = requests.post(API_GET_INSIGHTS, json=payload, timeout=600)
+        response = post_with_circuit("get_insights", API_GET_INSIGHTS, payload)
+        process_ids = extract_process_ids(response)
         if response.status_code == 200:
-            return True, "Insights generated successfully"
+            return True, "Insights generated successfully", process_ids
         else:
-            return False, f"API returned status {response.status_code}: {response.text}"
-    except requests.exceptions.Timeout:
-        return False, "Request timed out. Please try again."
+            return False, f"API returned status {response.status_code}: {response.text}", process_ids
+    except CircuitOpenError as e:
+        return False, str(e), None
     except requests.exceptions.ConnectionError:
-        return False, "Connection error. Please check your network or API endpoint."
+        # Includes ConnectTimeout, so this must come before Timeout
+        return False, "Connection error. Please check your network or API endpoint.", None
+    except requests.exceptions.Timeout:
+        return False, "Request timed out. Please try again.", []
     except Exception as e:
-        return False, f"Unexpected error: {str(e)}"
+        return False, f"Unexpected error: {str(e)}", []
 
-def trigger_chat(query, selected_files):
-    """Trigger chat API."""
-    st.session_state.chat_counter += 1
+def record_insight_job(file_info, error, process_ids, retry_no=0):
+    """Record a failed insight job so it can be resumed later."""
+    jobs = load_insight_jobs()
+    previous = jobs.get(file_info["file_id"], {})
+    jobs[file_info["file_id"]] = {
+        "file_info": file_info,
+        "retry_no": retry_no,
+        # Keep the last known process IDs if this attempt returned none
+        "retry_process_id": process_ids or previous.get("retry_process_id", []),
+        "last_error": error,
+        "last_attempt": datetime.now().isoformat()
+    }
+    save_insight_jobs(jobs)
+
+def retry_insight_job(file_id, uploaded_files_data):
+    """Re-submit a recorded insight job, reusing its S3 object and DB row."""
+    jobs = load_insight_jobs()
+    job = jobs.get(file_id)
+    if not job:
+        return False, "No pending insight job for this file"
+    if job["retry_no"] >= INSIGHT_MAX_RETRIES:
+        return False, f"Retry limit of {INSIGHT_MAX_RETRIES} reached"
     
-    file_ids = [f["file_id"] for f in selected_files] if selected_files else []
+    file_info = job["file_info"]
     
-    payload = {
+    # The original presigned URL may have expired
+    presigned_url = generate_presigned_url(file_info["s3_key"])
+    if not presigned_url:
+        return False, "Failed to generate presigned URL"
+    file_info["presigned_url"] = presigned_url
+    
+    retry_no = job["retry_no"] + 1
+    success, message, process_ids = trigger_get_insights(
+        file_info,
+        retry_no=retry_no,
+        retry_process_id=job["retry_process_id"]
+    )
+    
+    if success:
+        uploaded_files_data.append(file_info)
+        save_data(uploaded_files_data)
+        jobs = load_insight_jobs()
+        jobs.pop(file_id, None)
+        save_insight_jobs(jobs)
+    elif process_ids is None:
+        # Never reached the backend, so this attempt doesn't use up a retry
+        record_insight_job(file_info, message, [], job["retry_no"])
+    else:
+        record_insight_job(file_info, message, process_ids, retry_no)
+    return success, message
+
+def discard_insight_job(file_id):
+    """Drop a failed insight job along with its DB row, vectors and S3 object."""
+    jobs = load_insight_jobs()
+    job = jobs.pop(file_id, None)
+    if not job:
+        return False
+    
+    delete_file_from_db(file_id)
+    
+    # A partial run may already have written vectors
+    success, message = remove_vectors_from_db(file_id)
+    if not success:
+        st.warning(f"Failed to remove vectors: {message}")
+    
+    delete_file_from_s3(job["file_info"]["s3_key"])
+    save_insight_jobs(jobs)
+    return True
+
+def is_duplicate_upload(file_name, uploaded_files_data, insight_jobs):
+    """Warn and return True if file_name is already uploaded or pending."""
+    if any(f["file_name"] == file_name for f in uploaded_files_data):
+        st.warning(f"File '{file_name}' already exists in the system.")
+        return True
+    if any(job["file_info"]["file_name"] == file_name for job in insight_jobs.values()):
+        st.warning(f"File '{file_name}' is awaiting an insights retry below.")
+        return True
+    return False
+
+def register_uploaded_file(file_name, file_size, s3_key, uploaded_files_data):
+    """Register an uploaded S3 object and trigger insights.
+    
+    Returns (success, message). A failed insights call is recorded as a
+    pending job rather than rolled back.
+    """
+    file_type = "docx" if file_name.endswith(".docx") else "pdf"
+    
+    # Generate presigned URL
+    presigned_url = generate_presigned_url(s3_key)
+    if not presigned_url:
+        return False, "Failed to generate presigned URL"
+    
+    file_info = {
+        "file_id": str(uuid.uuid4()),
+        "file_name": file_name,
+        "file_type": file_type,
+        "file_size": file_size,
+        "upload_date": datetime.now().isoformat(),
+        "user_id": DEFAULT_USER_ID,
+        "org_id": DEFAULT_ORG_ID,
+        "tag_id": DEFAULT_TAG_ID,
+        "s3_key": s3_key,
+        "s3_bucket": S3_BUCKET_NAME,
+        "presigned_url": presigned_url
+    }
+    
+    # Store in database
+    success, result = store_uploaded_file_in_db(file_info)
+    if not success:
+        return False, f"Database error: {result}"
+    
+    # Trigger insights
+    success, message, process_ids = trigger_get_insights(file_info)
+    if not success:
+        # Keep the S3 object and DB row so the job can resume
+        record_insight_job(file_info, message, process_ids)
+        return False, f"Insights generation failed: {message}"
+    
+    uploaded_files_data.append(file_info)
+    save_data(uploaded_files_data)
+    return True, f"File '{file_name}' uploaded successfully"
+
+def build_chat_payload(query, file_ids):
+    """Build a chat API payload for the current session."""
+    return {
         "session_id": st.session_state.session_id,
         "client_id": st.session_state.client_id,
         "parent_session_id": st.session_state.session_id,
@@ -491,13 +922,17 @@ def trigger_chat(query, selected_files):
         "enable_agent": True,
         "tag_ids": [DEFAULT_TAG_ID]
     }
-    
+
+def send_chat_payload(payload):
+    """POST a chat payload. Safe to call from worker threads."""
     try:
-        response = requests.post(CHAT_API, json=payload, timeout=520)
+        response = post_with_circuit("chat", CHAT_API, payload)
         if response.status_code == 200:
             return response.json()
         else:
             return {"response": f"Error: {response.text}"}
+    except CircuitOpenError as e:
+        return {"response": str(e)}
     except requests.exceptions.Timeout:
         return {"response": "Request timed out. Your query might be too complex."}
     except requests.exceptions.ConnectionError:
@@ -505,6 +940,51 @@ def trigger_chat(query, selected_files):
     except Exception as e:
         return {"response": f"Chat API call failed: {str(e)}"}
 
+def trigger_chat(query, selected_files):
+    """Trigger chat API. Returns (response, payload)."""
+    st.session_state.chat_counter += 1
+    
+    file_ids = [f["file_id"] for f in selected_files] if selected_files else []
+    payload = build_chat_payload(query, file_ids)
+    return send_chat_payload(payload), payload
+
+def iter_chat_fanout(query, selected_files):
+    """Query shards of the selected files concurrently.
+    
+    Yields (shard, response, payload) as each request completes, so partial
+    answers can be shown before the slowest document finishes. Each shard is
+    its own chat turn with a distinct chat_id, so concurrent requests never
+    share a (session_id, chat_id) key on the backend.
+    """
+    shards = [
+        selected_files[i:i + CHAT_FANOUT_SHARD_SIZE]
+        for i in range(0, len(selected_files), CHAT_FANOUT_SHARD_SIZE)
+    ]
+    # Payloads read session state, so build them before handing off to threads
+    payloads = []
+    for shard in shards:
+        st.session_state.chat_counter += 1
+        payloads.append(build_chat_payload(query, [f["file_id"] for f in shard]))
+    
+    with ThreadPoolExecutor(max_workers=min(CHAT_FANOUT_MAX_WORKERS, len(shards))) as pool:
+        futures = {
+            pool.submit(send_chat_payload, payload): (shard, payload)
+            for shard, payload in zip(shards, payloads)
+        }
+        for future in as_completed(futures):
+            shard, payload = futures[future]
+            yield shard, future.result(), payload
+
+def merge_fanout_answers(results, selected_files):
+    """Merge per-shard answers in selection order, attributing each to its files."""
+    order = {f["file_id"]: i for i, f in enumerate(selected_files)}
+    sections = []
+    for shard, response in sorted(results, key=lambda r: order[r[0][0]["file_id"]]):
+        answer, error, _ = parse_response(response)
+        source = ", ".join(f["file_name"] for f in shard)
+        sections.append(f"<b>Source: {source}</b><br>{answer if not error else f'Error: {error}'}")
+    return "<br><br>".join(sections)
+
 def delete_file(file_id, uploaded_files_data):
     """Delete a file from the system."""
     file_to_delete = next((f for f in uploaded_files_data if f["file_id"] == file_id), None)
@@ -577,9 +1057,340 @@ def parse_response(data):
     
     return answer_text[:65000], error_text[:65000], raw_json_text[:65000]
 
+# ------------------------------
+# CHAT SEARCH INDEX
+# ------------------------------
+def get_chat_index_connection():
+    """Open a connection to the chat full-text index."""
+    return sqlite3.connect(CHAT_INDEX_DB, timeout=10)
+
+@st.cache_resource
+def init_chat_index():
+    """Create the FTS5 index once per server, backfilling from chat history."""
+    try:
+        os.makedirs(os.path.dirname(CHAT_INDEX_DB), exist_ok=True)
+        conn = get_chat_index_connection()
+        try:
+            with conn:
+                conn.execute("""
+                    CREATE VIRTUAL TABLE IF NOT EXISTS chat_fts USING fts5(
+                        query, response, files, session_id,
+                        chat_id UNINDEXED, timestamp UNINDEXED,
+                        tokenize = 'porter unicode61'
+                    )
+                """)
+                indexed = conn.execute("SELECT COUNT(*) FROM chat_fts").fetchone()[0]
+                if indexed == 0:
+                    history = load_chat_history()
+                    conn.executemany(
+                        "INSERT INTO chat_fts VALUES (?, ?, ?, ?, ?, ?)",
+                        [chat_index_row(chat) for chat in history]
+                    )
+                    print(f"[DEBUG] Backfilled {len(history)} chat messages into {CHAT_INDEX_DB}")
+        finally:
+            conn.close()
+        return True
+    except sqlite3.Error as e:
+        print(f"[DEBUG] Chat index unavailable: {e}")
+        return False
+
+def chat_index_row(chat):
+    """Map a chat_entry to a chat_fts row."""
+    return (
+        chat.get("query", ""),
+        chat.get("response", ""),
+        " ".join(chat.get("files", [])),
+        str(chat.get("session_id", "")),
+        chat.get("chat_id"),
+        chat.get("timestamp")
+    )
+
+def index_chat_entry(chat):
+    """Add a single chat_entry to the search index."""
+    if not init_chat_index():
+        return
+    try:
+        conn = get_chat_index_connection()
+        try:
+            with conn:
+                conn.execute("INSERT INTO chat_fts VALUES (?, ?, ?, ?, ?, ?)", chat_index_row(chat))
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        print(f"[DEBUG] Error indexing chat message: {e}")
+
+def search_chat_history(text, limit=CHAT_SEARCH_LIMIT):
+    """Return ranked chat hits for a free-text search."""
+    if not init_chat_index():
+        return []
+    
+    # Quote each term so user input can't break FTS5 query syntax
+    terms = [f'"{term.replace(chr(34), chr(34) * 2)}"' for term in text.split()]
+    if not terms:
+        return []
+    
+    try:
+        conn = get_chat_index_connection()
+        try:
+            rows = conn.execute("""
+                SELECT session_id, chat_id, timestamp, query,
+                       snippet(chat_fts, 1, '**', '**', '...', 24),
+                       files
+                FROM chat_fts
+                WHERE chat_fts MATCH ?
+                ORDER BY bm25(chat_fts, 4.0, 1.0, 2.0, 1.0)
+                LIMIT ?
+            """, (" ".join(terms), limit)).fetchall()
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        st.error(f"Error searching chat history: {e}")
+        return []
+    
+    return [
+        {
+            "session_id": row[0],
+            "chat_id": row[1],
+            "timestamp": row[2],
+            "query": row[3],
+            "snippet": row[4],
+            "files": row[5]
+        }
+        for row in rows
+    ]
+
+# ------------------------------
+# RAW RESPONSE ARCHIVE
+# ------------------------------
+@st.cache_resource
+def get_raw_archive_lock():
+    """Lock serializing archive writes across sessions."""
+    return threading.Lock()
+
+def get_raw_archive_connection():
+    """Open the archive offset index, creating it if needed."""
+    os.makedirs(RAW_ARCHIVE_DIR, exist_ok=True)
+    conn = sqlite3.connect(RAW_ARCHIVE_INDEX, timeout=10)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS raw_responses (
+            request_id TEXT PRIMARY KEY,
+            segment INTEGER NOT NULL,
+            offset INTEGER NOT NULL,
+            length INTEGER NOT NULL,
+            timestamp TEXT
+        )
+    """)
+    return conn
+
+def raw_archive_segment_path(segment):
+    """Path of an archive segment file."""
+    return f"{RAW_ARCHIVE_DIR}/segment_{segment:06d}.gz"
+
+def list_raw_archive_segments():
+    """Return existing segment numbers, oldest first."""
+    if not os.path.exists(RAW_ARCHIVE_DIR):
+        return []
+    return sorted(
+        int(name[len("segment_"):-len(".gz")])
+        for name in os.listdir(RAW_ARCHIVE_DIR)
+        if name.startswith("segment_") and name.endswith(".gz")
+    )
+
+def archive_raw_response(request_id, payload, response, aliases=()):
+    """Append a raw chat request/response as its own gzip member.
+    
+    Segments are valid multi-member .gz files; the index stores the offset
+    of each member so a single record can be read back without scanning.
+    Each id in aliases (e.g. a fan-out shard's request_id) indexes the same
+    record.
+    """
+    record = gzip.compress(json.dumps({
+        "request_id": request_id,
+        "timestamp": datetime.now().isoformat(),
+        "payload": payload,
+        "response": response
+    }, ensure_ascii=False, default=str).encode("utf-8"))
+    
+    try:
+        with get_raw_archive_lock():
+            conn = get_raw_archive_connection()
+            try:
+                # Rotate once the active segment is full
+                segments = list_raw_archive_segments()
+                segment = segments[-1] if segments else 1
+                path = raw_archive_segment_path(segment)
+                if os.path.exists(path) and os.path.getsize(path) >= RAW_ARCHIVE_SEGMENT_BYTES:
+                    segment += 1
+                    path = raw_archive_segment_path(segment)
+                    segments.append(segment)
+                
+                with open(path, "ab") as f:
+                    offset = f.tell()
+                    f.write(record)
+                
+                with conn:
+                    conn.executemany(
+                        "INSERT OR REPLACE INTO raw_responses VALUES (?, ?, ?, ?, ?)",
+                        [
+                            (record_id, segment, offset, len(record), datetime.now().isoformat())
+                            for record_id in [request_id, *aliases]
+                        ]
+                    )
+                    
+                    # Retention: drop the oldest segments beyond the size budget
+                    total = sum(os.path.getsize(raw_archive_segment_path(n)) for n in segments)
+                    for oldest in segments[:-1]:
+                        if total <= RAW_ARCHIVE_MAX_BYTES:
+                            break
+                        oldest_path = raw_archive_segment_path(oldest)
+                        total -= os.path.getsize(oldest_path)
+                        os.remove(oldest_path)
+                        conn.execute("DELETE FROM raw_responses WHERE segment = ?", (oldest,))
+                        print(f"[DEBUG] Removed expired archive segment {oldest_path}")
+            finally:
+                conn.close()
+    except (OSError, sqlite3.Error) as e:
+        print(f"[DEBUG] Error archiving raw response: {e}")
+
+def load_raw_response(request_id):
+    """Read one archived record by request_id, or None if absent or expired."""
+    try:
+        conn = get_raw_archive_connection()
+        try:
+            row = conn.execute(
+                "SELECT segment, offset, length FROM raw_responses WHERE request_id = ?",
+                (request_id,)
+            ).fetchone()
+        finally:
+            conn.close()
+        if not row:
+            return None
+        
+        segment, offset, length = row
+        with open(raw_archive_segment_path(segment), "rb") as f:
+            f.seek(offset)
+            return json.loads(gzip.decompress(f.read(length)))
+    except (OSError, sqlite3.Error, ValueError) as e:
+        print(f"[DEBUG] Error loading raw response {request_id}: {e}")
+        return None
+
+def raw_archive_stats():
+    """Summarize the archive for the debug panel."""
+    segments = list_raw_archive_segments()
+    try:
+        conn = get_raw_archive_connection()
+        try:
+            # Aliased ids share a record, so count distinct offsets
+            records = conn.execute(
+                "SELECT COUNT(*) FROM (SELECT DISTINCT segment, offset FROM raw_responses)"
+            ).fetchone()[0]
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        records = None
+    return {
+        "records": records,
+        "segments": len(segments),
+        "total_size": format_file_size(
+            sum(os.path.getsize(raw_archive_segment_path(n)) for n in segments)
+        )
+    }
+
+# ------------------------------
+# PREFETCH
+# ------------------------------
+@st.cache_resource
+def get_prefetch_executor():
+    """Background workers for selection prefetch."""
+    return ThreadPoolExecutor(max_workers=2)
+
+@st.cache_resource
+def get_first_query_metrics():
+    """First-query latencies after a selection change, split by warm/cold."""
+    return {
+        "warm": deque(maxlen=FIRST_QUERY_METRIC_WINDOW),
+        "cold": deque(maxlen=FIRST_QUERY_METRIC_WINDOW),
+        "lock": threading.Lock()
+    }
+
+def refresh_presigned_urls(files, uploaded_files_data):
+    """Re-sign URLs for files whose presigned URL is past half its lifetime."""
+    now = time.time()
+    refreshed = 0
+    for file_info in files:
+        if now - file_info.get("presigned_url_refreshed_at", 0) < PRESIGNED_URL_EXPIRATION / 2:
+            continue
+        try:
+            presigned_url = generate_presigned_url(file_info["s3_key"])
+        except BotoCoreError as e:
+            # e.g. missing credentials; prefetch must never break the page
+            print(f"[DEBUG] Prefetch could not re-sign {file_info['s3_key']}: {e}")
+            continue
+        if presigned_url:
+            file_info["presigned_url"] = presigned_url
+            file_info["presigned_url_refreshed_at"] = now
+            refreshed += 1
+    if refreshed:
+        save_data(uploaded_files_data)
+    return refreshed
+
+def warm_backend(session, s3_client):
+    """Open pooled connections to the backend and S3. Runs off the script thread."""
+    for url in {API_GET_INSIGHTS, CHAT_API, DELETE_FILE_API}:
+        try:
+            # Any response will do; the point is the DNS/TCP/TLS handshake
+            session.head(url, timeout=PREFETCH_TIMEOUT)
+        except requests.exceptions.RequestException:
+            pass
+    
+    if s3_client:
+        # One request warms the pooled connection for every key in the bucket
+        try:
+            s3_client.head_bucket(Bucket=S3_BUCKET_NAME)
+        except (ClientError, BotoCoreError) as e:
+            print(f"[DEBUG] Prefetch head_bucket failed: {e}")
+
+def prefetch_selection(selected_files, uploaded_files_data):
+    """Warm everything the next question will need for the selected files."""
+    refresh_presigned_urls(selected_files, uploaded_files_data)
+    
+    # A job still running is already warming the same connections
+    future = st.session_state.prefetch_future
+    if future is not None and not future.done():
+        return
+    st.session_state.prefetch_future = get_prefetch_executor().submit(
+        warm_backend,
+        get_http_session(),
+        get_s3_client()
+    )
+
+def record_first_query_latency(elapsed):
+    """Record the first query after a selection change as warm or cold."""
+    future = st.session_state.prefetch_future
+    kind = "warm" if future is not None and future.done() else "cold"
+    metrics = get_first_query_metrics()
+    with metrics["lock"]:
+        metrics[kind].append(elapsed)
+
+def first_query_stats():
+    """Summarize warm vs cold first-query latency for the debug panel."""
+    metrics = get_first_query_metrics()
+    stats = {}
+    with metrics["lock"]:
+        for kind in ("warm", "cold"):
+            samples = sorted(metrics[kind])
+            stats[kind] = {
+                "count": len(samples),
+                "median_ms": round(samples[len(samples) // 2] * 1000) if samples else None
+            }
+    return stats
+
 # ------------------------------
 # INITIALIZE SESSION
 # ------------------------------
+# Build the search index before a new session clears the chat history file
+init_chat_index()
+
 if st.session_state.session_id == 0:
     create_new_session()
     # Load chat history from file on first load
@@ -589,6 +1400,7 @@ if st.session_state.session_id == 0:
 # LOAD DATA ON EVERY RUN
 # ------------------------------
 uploaded_files_data = load_data()
+insight_jobs = load_insight_jobs()
 
 # Sync chat history from file if empty
 if not st.session_state.chat_history:
@@ -605,7 +1417,7 @@ col1, col2, col3 = st.columns([2, 2, 1])
 with col1:
     st.caption(f"Session ID: {st.session_state.session_id}")
 with col2:
-    st.caption(f"Messages: {st.session_state.chat_counter}")
+    st.caption(f"Messages: {st.session_state.message_counter}")
 with col3:
     if st.button("New Session"):
         create_new_session()
@@ -620,6 +1432,7 @@ with st.expander("Debug Information", expanded=False):
     st.json({
         "session_id": st.session_state.session_id,
         "chat_counter": st.session_state.chat_counter,
+        "message_counter": st.session_state.message_counter,
         "uploaded_file_key": st.session_state.uploaded_file_key,
         "selected_file_ids": st.session_state.selected_file_ids,
         "chat_history_count": len(st.session_state.chat_history)
@@ -629,10 +1442,23 @@ with st.expander("Debug Information", expanded=False):
     if uploaded_files_data:
         st.json(uploaded_files_data)
     
+    st.write("**Circuit Breakers:**")
+    st.json({
+        name: circuit.snapshot()
+        for name, circuit in get_circuit_breakers().items()
+    })
+    
+    st.write("**First Query Latency (warm vs cold):**")
+    st.json(first_query_stats())
+    
+    st.write("**Raw Response Archive:**")
+    st.json(raw_archive_stats())
+    
     st.write("**File Paths:**")
     st.write(f"- Data Store: {DATA_STORE} (Exists: {os.path.exists(DATA_STORE)})")
     st.write(f"- Chat History: {CHAT_HISTORY_FILE} (Exists: {os.path.exists(CHAT_HISTORY_FILE)})")
     st.write(f"- Session Data: {SESSION_DATA_FILE} (Exists: {os.path.exists(SESSION_DATA_FILE)})")
+    st.write(f"- Reconcile State: {RECONCILE_STATE_FILE} (Exists: {os.path.exists(RECONCILE_STATE_FILE)})")
 
 # ------------------------------
 # SIDEBAR: FILE MANAGEMENT
@@ -661,26 +1487,69 @@ with st.sidebar:
     
     # File Upload Section
     st.subheader("Upload Document")
-    uploaded_file = st.file_uploader(
-        "Choose a file",
-        type=["docx", "pdf"],
-        help="Upload DOCX or PDF files to analyze",
-        key=f"file_uploader_{st.session_state.uploaded_file_key}"
-    )
     
-    if uploaded_file:
-        file_name = uploaded_file.name
-        file_type = "docx" if file_name.endswith(".docx") else "pdf"
+    if UPLOAD_MODE == "direct":
+        # Browser uploads straight to S3; the app only registers metadata.
+        direct_upload = st.session_state.direct_upload
+        if not direct_upload or direct_upload["expires_at"] <= time.time():
+            # The random part keeps sessions signing in the same second apart
+            key_prefix = build_s3_key(f"{uuid.uuid4().hex[:12]}_")
+            presigned_post = generate_presigned_post(key_prefix)
+            # The browser may have uploaded with the expired POST just before
+            # this rerun, so Register still looks under the previous prefix
+            previous_prefix = direct_upload["key_prefix"] if direct_upload else None
+            direct_upload = {
+                "key_prefix": key_prefix,
+                "previous_prefix": previous_prefix,
+                "presigned_post": presigned_post,
+                "expires_at": time.time() + DIRECT_UPLOAD_URL_EXPIRATION
+            } if presigned_post else None
+            st.session_state.direct_upload = direct_upload
         
-        # Check for duplicates by file name
-        existing_file = next((f for f in uploaded_files_data if f["file_name"] == file_name), None)
+        if direct_upload:
+            render_direct_upload_widget(direct_upload["presigned_post"])
+            if st.button("Register Upload"):
+                key_prefix = direct_upload["key_prefix"]
+                direct_uploads = find_direct_uploads(key_prefix)
+                if not direct_uploads and direct_upload["previous_prefix"]:
+                    key_prefix = direct_upload["previous_prefix"]
+                    direct_uploads = find_direct_uploads(key_prefix)
+                if not direct_uploads:
+                    st.warning("No uploaded file found yet. Upload the file first.")
+                else:
+                    # Only the latest upload under this prefix is registered
+                    latest, superseded = direct_uploads[0], direct_uploads[1:]
+                    for obj in superseded:
+                        delete_file_from_s3(obj["Key"])
+                    if superseded:
+                        st.info(f"Removed {len(superseded)} earlier upload(s); registering the latest one.")
+                    
+                    s3_key, file_size = latest["Key"], latest["Size"]
+                    file_name = s3_key[len(key_prefix):]
+                    # A fresh prefix is needed for the next upload either way
+                    st.session_state.direct_upload = None
+                    if is_duplicate_upload(file_name, uploaded_files_data, insight_jobs):
+                        delete_file_from_s3(s3_key)
+                    else:
+                        with st.spinner("Processing file..."):
+                            success, message = register_uploaded_file(
+                                file_name, file_size, s3_key, uploaded_files_data
+                            )
+                        if success:
+                            st.rerun()
+                        st.error(message)
+                        insight_jobs = load_insight_jobs()
+    else:
+        uploaded_file = st.file_uploader(
+            "Choose a file",
+            type=["docx", "pdf"],
+            help="Upload DOCX or PDF files to analyze",
+            key=f"file_uploader_{st.session_state.uploaded_file_key}"
+        )
         
-        if existing_file:
-            st.warning(f"File '{file_name}' already exists in the system.")
-        else:
+        if uploaded_file and not is_duplicate_upload(uploaded_file.name, uploaded_files_data, insight_jobs):
+            file_name = uploaded_file.name
             with st.spinner("Processing file..."):
-                file_id = str(uuid.uuid4())
-                
                 # Upload to S3
                 uploaded_file.seek(0)
                 s3_key, error = upload_file_to_s3(uploaded_file, file_name)
@@ -688,45 +1557,44 @@ with st.sidebar:
                 if error:
                     st.error(f"Upload failed: {error}")
                 else:
-                    # Generate presigned URL
-                    presigned_url = generate_presigned_url(s3_key)
+                    success, message = register_uploaded_file(
+                        file_name, uploaded_file.size, s3_key, uploaded_files_data
+                    )
                     
-                    if not presigned_url:
-                        st.error("Failed to generate presigned URL")
+                    # Reset file uploader
+                    st.session_state.uploaded_file_key += 1
+                    if success:
+                        st.rerun()
+                    st.error(message)
+                    insight_jobs = load_insight_jobs()
+    
+    # Pending Insights Section
+    if insight_jobs:
+        st.markdown("---")
+        st.subheader("Pending Insights")
+        for job_file_id, job in insight_jobs.items():
+            st.caption(
+                f"**{job['file_info']['file_name']}** | retry {job['retry_no']}/{INSIGHT_MAX_RETRIES} | "
+                f"{job['last_error'][:120]}"
+            )
+            col_retry, col_discard = st.columns(2)
+            with col_retry:
+                if st.button(
+                    "Retry",
+                    key=f"retry_{job_file_id}",
+                    disabled=job["retry_no"] >= INSIGHT_MAX_RETRIES
+                ):
+                    with st.spinner("Resuming insight extraction..."):
+                        success, message = retry_insight_job(job_file_id, uploaded_files_data)
+                    if success:
+                        st.success(f"File '{job['file_info']['file_name']}' uploaded successfully")
+                        st.rerun()
                     else:
-                        file_info = {
-                            "file_id": file_id,
-                            "file_name": file_name,
-                            "file_type": file_type,
-                            "file_size": uploaded_file.size,
-                            "upload_date": datetime.now().isoformat(),
-                            "user_id": DEFAULT_USER_ID,
-                            "org_id": DEFAULT_ORG_ID,
-                            "tag_id": DEFAULT_TAG_ID,
-                            "s3_key": s3_key,
-                            "s3_bucket": S3_BUCKET_NAME,
-                            "presigned_url": presigned_url
-                        }
-                        
-                        # Store in database
-                        success, result = store_uploaded_file_in_db(file_info)
-                        if not success:
-                            st.error(f"Database error: {result}")
-                        else:
-                            # Trigger insights
-                            success, message = trigger_get_insights(file_info)
-                            
-                            if success:
-                                uploaded_files_data.append(file_info)
-                                save_data(uploaded_files_data)
-                                st.success(f"File '{file_name}' uploaded successfully")
-                                
-                                # Reset file uploader
-                                st.session_state.uploaded_file_key += 1
-                                st.rerun()
-                            else:
-                                st.error(f"Insights generation failed: {message}")
-                                delete_file_from_db(file_id)
+                        st.error(f"Retry failed: {message}")
+            with col_discard:
+                if st.button("Discard", key=f"discard_{job_file_id}"):
+                    discard_insight_job(job_file_id)
+                    st.rerun()
     
     st.markdown("---")
     
@@ -790,11 +1658,55 @@ st.header("Chat Interface")
 # Get selected files
 selected_files = [f for f in uploaded_files_data if f["file_id"] in st.session_state.selected_file_ids]
 
+# Warm up as soon as the selection changes, before the first question
+selection = sorted(st.session_state.selected_file_ids)
+if selection != st.session_state.prefetched_file_ids:
+    st.session_state.prefetched_file_ids = selection
+    # Drop this session's queued job so stale work can't pile up in the
+    # shared executor; a running one can't be cancelled and is kept
+    future = st.session_state.prefetch_future
+    if future is not None and (future.cancel() or not selected_files):
+        st.session_state.prefetch_future = None
+    # General chat has nothing to prefetch, so it is not a warm/cold sample
+    st.session_state.first_query_pending = bool(selected_files)
+    if PREFETCH_ENABLED and selected_files:
+        prefetch_selection(selected_files, uploaded_files_data)
+
 if selected_files:
     st.info(f"Active context: {len(selected_files)} document(s) - {', '.join([f['file_name'] for f in selected_files])}")
 else:
     st.info("General chat mode (no documents selected)")
 
+fanout_mode = False
+if len(selected_files) > 1:
+    fanout_mode = st.checkbox(
+        "Query each document in parallel",
+        key="fanout_mode",
+        help=f"Sends concurrent requests (up to {CHAT_FANOUT_MAX_WORKERS} at a time) and merges the answers by source"
+    )
+
+# Search Past Chats
+with st.expander("Search Past Chats", expanded=False):
+    search_text = st.text_input(
+        "Search past questions and answers:",
+        placeholder="e.g. termination clause",
+        key="chat_search_input"
+    )
+    if search_text.strip():
+        search_start = time.perf_counter()
+        hits = search_chat_history(search_text)
+        search_ms = (time.perf_counter() - search_start) * 1000
+        st.caption(f"{len(hits)} result(s) in {search_ms:.1f} ms")
+        for hit in hits:
+            st.markdown(f"**Q:** {hit['query']}")
+            st.markdown(hit["snippet"])
+            st.caption(
+                f"Session #{hit['session_id']} | Message #{hit['chat_id']} | "
+                f"{(hit['timestamp'] or 'N/A')[:19]}"
+                + (f" | {hit['files']}" if hit["files"] else "")
+            )
+            st.markdown("---")
+
 # Chat History Display
 chat_container = st.container()
 with chat_container:
@@ -813,6 +1725,14 @@ with chat_container:
             <strong>Deep Thinker:</strong><br>{chat['response']}
         </div>
         """, unsafe_allow_html=True)
+        
+        # Raw trace, read from the archive only when asked for
+        if chat.get("request_id") and st.toggle("Show raw response", key=f"raw_{chat['request_id']}"):
+            raw_record = load_raw_response(chat["request_id"])
+            if raw_record:
+                st.json(raw_record, expanded=False)
+            else:
+                st.caption("Raw response is no longer archived.")
 
 # Chat Input
 st.markdown("---")
@@ -838,9 +1758,35 @@ if send_button:
     if not query.strip():
         st.warning("Please enter a question first.")
     else:
+        st.session_state.message_counter += 1
         with st.spinner("Processing your query..."):
-            response = trigger_chat(query, selected_files)
-            answer, error, raw = parse_response(response)
+            query_start = time.perf_counter()
+            if fanout_mode:
+                results = []
+                progress = st.empty()
+                for shard, shard_response, shard_payload in iter_chat_fanout(query, selected_files):
+                    results.append((shard, shard_response, shard_payload))
+                    progress.markdown(f"""
+                    <div class="chat-message bot-message">
+                        <strong>Deep Thinker ({sum(len(r[0]) for r in results)}/{len(selected_files)} documents):</strong><br>
+                        {merge_fanout_answers([r[:2] for r in results], selected_files)}
+                    </div>
+                    """, unsafe_allow_html=True)
+                
+                # One archive record per question, holding every shard's trace
+                payload = {"request_id": str(uuid.uuid4()), "shards": [r[2] for r in results]}
+                response = {"shards": [r[1] for r in results]}
+                answer, error = merge_fanout_answers([r[:2] for r in results], selected_files), ""
+            else:
+                response, payload = trigger_chat(query, selected_files)
+                answer, error, raw = parse_response(response)
+            
+            if st.session_state.first_query_pending and selected_files:
+                record_first_query_latency(time.perf_counter() - query_start)
+                st.session_state.first_query_pending = False
+            # Shard request_ids are what the backend logs, so they find the record too
+            shard_request_ids = [shard["request_id"] for shard in payload.get("shards", [])]
+            archive_raw_response(payload["request_id"], payload, response, shard_request_ids)
             
             # Add to chat history
             chat_entry = {
@@ -848,11 +1794,13 @@ if send_button:
                 "response": answer if not error else f"Error: {error}",
                 "timestamp": datetime.now().isoformat(),
                 "session_id": st.session_state.session_id,
-                "chat_id": st.session_state.chat_counter,
+                "chat_id": st.session_state.message_counter,
+                "request_id": payload["request_id"],
                 "files": [f["file_name"] for f in selected_files] if selected_files else []
             }
             st.session_state.chat_history.append(chat_entry)
             save_chat_history(st.session_state.chat_history)
+            index_chat_entry(chat_entry)
             
             st.rerun()
 
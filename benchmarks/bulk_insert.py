@@ -0,0 +1,151 @@
+"""Benchmark batched file registration against a local DB stand-in.
+
+Uses an on-disk SQLite database with the files/file_tags columns the app
+writes, wrapped so each statement and commit also pays a simulated network
+round trip (--rtt-ms) as it would against MySQL. Reports rows/sec for the
+old per-file path (new connection, two INSERTs and a commit per file) and
+for insert_files_batched at several batch sizes.
+
+Usage:
+    python benchmarks/bulk_insert.py [--rows 2000] [--batch-sizes 1 50 500] [--rtt-ms 0.5]
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from file_registry import insert_file, insert_files_batched  # noqa: E402
+
+SCHEMA = """
+    CREATE TABLE files (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT, user_id INTEGER, upload_state INTEGER, file_size INTEGER,
+        ci_file_guid TEXT UNIQUE, ci_org_guid TEXT, type INTEGER, status INTEGER,
+        is_contract INTEGER, is_template INTEGER
+    );
+    CREATE TABLE file_tags (file_temp_id TEXT, tag_id INTEGER);
+"""
+
+
+class RoundTripCursor:
+    """Cursor proxy charging one round trip per statement."""
+
+    def __init__(self, cursor, rtt):
+        self.cursor = cursor
+        self.rtt = rtt
+
+    def execute(self, sql, params=()):
+        time.sleep(self.rtt)
+        return self.cursor.execute(sql, params)
+
+    def executemany(self, sql, rows):
+        # pymysql sends a multi-row INSERT as a single statement
+        time.sleep(self.rtt)
+        return self.cursor.executemany(sql, rows)
+
+    def close(self):
+        self.cursor.close()
+
+
+class RoundTripConnection:
+    """Connection proxy charging one round trip per connect and commit."""
+
+    def __init__(self, path, rtt):
+        time.sleep(rtt * 3)  # TCP + auth handshake
+        self.conn = sqlite3.connect(path)
+        self.rtt = rtt
+
+    def cursor(self):
+        return RoundTripCursor(self.conn.cursor(), self.rtt)
+
+    def commit(self):
+        time.sleep(self.rtt)
+        self.conn.commit()
+
+    def rollback(self):
+        time.sleep(self.rtt)
+        self.conn.rollback()
+
+    def close(self):
+        self.conn.close()
+
+
+def make_file_infos(count):
+    return [
+        {
+            "file_id": str(uuid.uuid4()),
+            "file_name": f"document_{i}.pdf",
+            "file_size": 1024 * (i + 1),
+            "user_id": 101,
+            "tag_id": 123,
+        }
+        for i in range(count)
+    ]
+
+
+def fresh_db(directory, label):
+    path = os.path.join(directory, f"{label}.db")
+    conn = sqlite3.connect(path)
+    conn.executescript(SCHEMA)
+    conn.close()
+    return path
+
+
+def per_file_path(path, file_infos, rtt):
+    """The previous store_uploaded_file_in_db loop: one connection per file."""
+    for file_info in file_infos:
+        conn = RoundTripConnection(path, rtt)
+        cursor = conn.cursor()
+        insert_file(cursor, file_info, placeholder="?")
+        conn.commit()
+        cursor.close()
+        conn.close()
+
+
+def batched_path(path, file_infos, rtt, batch_size):
+    conn = RoundTripConnection(path, rtt)
+    stored, failures = insert_files_batched(conn, file_infos, batch_size, placeholder="?")
+    conn.close()
+    return stored, failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=2000)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 50, 500])
+    parser.add_argument("--rtt-ms", type=float, default=0.5, help="simulated DB round trip")
+    args = parser.parse_args()
+    rtt = args.rtt_ms / 1000
+
+    file_infos = make_file_infos(args.rows)
+    print(f"{args.rows} files, simulated round trip {args.rtt_ms} ms")
+    print(f"{'path':>22} | {'rows/sec':>10}")
+    print("-" * 36)
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = fresh_db(directory, "per_file")
+        start = time.perf_counter()
+        per_file_path(path, file_infos, rtt)
+        print(f"{'per-file (old)':>22} | {args.rows / (time.perf_counter() - start):>10.0f}")
+
+        for batch_size in args.batch_sizes:
+            path = fresh_db(directory, f"batch_{batch_size}")
+            start = time.perf_counter()
+            stored, _ = batched_path(path, file_infos, rtt, batch_size)
+            elapsed = time.perf_counter() - start
+            print(f"{f'batched, size {batch_size}':>22} | {len(stored) / elapsed:>10.0f}")
+
+        # Per-row isolation: duplicates fail alone, the rest of the batch lands
+        path = fresh_db(directory, "isolation")
+        batched_path(path, file_infos[:10], 0, 500)
+        stored, failures = batched_path(path, file_infos[5:505], 0, 500)
+        print(f"\nisolation check: {len(stored)} stored, {len(failures)} duplicate rows rejected")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""Compare app-server memory for the two upload modes.
+
+"server" mode: Streamlit holds the whole file in memory as an UploadedFile
+(a BytesIO) and the app re-sends it with upload_fileobj.
+"direct" mode: the app only signs a presigned POST; the bytes go from the
+browser to S3 and never touch the app server.
+
+A tiny local S3 stand-in receives the uploads so the boto3 transfer path is
+exercised for real. Peak Python heap usage is measured with tracemalloc.
+
+Usage:
+    python benchmarks/upload_memory.py [--sizes 1 10 50] [--concurrency 4]
+"""
+import argparse
+import io
+import os
+import threading
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import boto3
+from botocore.config import Config
+
+BUCKET = "intel-repo"
+
+
+class FakeS3Handler(BaseHTTPRequestHandler):
+    """Accepts PutObject and multipart uploads and discards the body."""
+
+    def log_message(self, *args):
+        pass
+
+    def _drain(self):
+        remaining = int(self.headers.get("Content-Length", 0))
+        while remaining:
+            chunk = self.rfile.read(min(remaining, 1024 * 1024))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+
+    def _reply(self, body=b""):
+        self.send_response(200)
+        self.send_header("ETag", '"etag"')
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_PUT(self):
+        self._drain()
+        self._reply()
+
+    def do_POST(self):
+        self._drain()
+        if "uploads" in self.path and "uploadId" not in self.path:
+            self._reply(
+                b'<?xml version="1.0" encoding="UTF-8"?>'
+                b"<InitiateMultipartUploadResult>"
+                b"<Bucket>intel-repo</Bucket><Key>k</Key><UploadId>1</UploadId>"
+                b"</InitiateMultipartUploadResult>"
+            )
+        else:
+            self._reply(
+                b'<?xml version="1.0" encoding="UTF-8"?>'
+                b'<CompleteMultipartUploadResult><ETag>"etag"</ETag>'
+                b"</CompleteMultipartUploadResult>"
+            )
+
+
+def make_client(endpoint):
+    return boto3.client(
+        "s3",
+        region_name="us-east-1",
+        endpoint_url=endpoint,
+        aws_access_key_id="bench",
+        aws_secret_access_key="bench",
+        config=Config(s3={"addressing_style": "path"}),
+    )
+
+
+def server_mode(client, size_bytes, index):
+    # What Streamlit hands the app: the full file as an in-memory buffer
+    uploaded_file = io.BytesIO(os.urandom(size_bytes))
+    client.upload_fileobj(
+        uploaded_file,
+        BUCKET,
+        f"uploads/bench_{index}.pdf",
+        ExtraArgs={"ContentType": "application/octet-stream"},
+    )
+
+
+def direct_mode(client, size_bytes, index):
+    # The app only signs the POST; the browser sends the bytes to S3
+    client.generate_presigned_post(
+        BUCKET,
+        f"uploads/bench_{index}_" + "${filename}",
+        Fields={"Content-Type": "application/octet-stream"},
+        Conditions=[["content-length-range", 1, size_bytes]],
+        ExpiresIn=3600,
+    )
+
+
+def peak_memory(mode, client, size_bytes, concurrency):
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(lambda i: mode(client, size_bytes, i), range(concurrency)))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 10, 50], help="file sizes in MB")
+    parser.add_argument("--concurrency", type=int, default=4, help="simultaneous uploads")
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeS3Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    client = make_client(f"http://127.0.0.1:{server.server_address[1]}")
+
+    # Warm up the client so one-off import/allocation cost is not measured
+    direct_mode(client, 1, 0)
+    server_mode(client, 1024, 0)
+
+    print(f"Peak app-server heap, {args.concurrency} concurrent upload(s)")
+    print(f"{'file size':>10} | {'server mode':>12} | {'direct mode':>12}")
+    print("-" * 40)
+    for size_mb in args.sizes:
+        size_bytes = size_mb * 1024 * 1024
+        server_peak = peak_memory(server_mode, client, size_bytes, args.concurrency)
+        direct_peak = peak_memory(direct_mode, client, size_bytes, args.concurrency)
+        print(f"{size_mb:>7} MB | {server_peak / 2**20:>9.1f} MB | {direct_peak / 2**20:>9.2f} MB")
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+"""Shared settings, clients and file metadata registration.
+
+Used by app.py, reconcile.py and the benchmarks. The insert functions take
+an open DB-API connection, so the same code runs against MySQL (pymysql,
+"%s" placeholders) and local stand-ins such as sqlite3 ("?" placeholders).
+
+Usage:
+    python file_registry.py data/uploaded_files.json [--batch-size 500]
+"""
+import argparse
+import json
+import os
+
+import boto3
+import pymysql
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# ------------------------------
+# CONFIGURATION
+# ------------------------------
+DELETE_FILE_API = os.getenv("DELETE_FILE_URL", "https://your-api-endpoint.com/delete-files")
+DATA_DIR = "data"
+DATA_STORE = f"{DATA_DIR}/uploaded_files.json"
+INSIGHT_JOBS_FILE = f"{DATA_DIR}/insight_jobs.json"
+RECONCILE_STATE_FILE = f"{DATA_DIR}/reconcile_state.json"
+
+S3_BUCKET_NAME = "intel-repo"
+S3_UPLOAD_PREFIX = "uploads/"
+AWS_REGION = os.getenv("AWS_REGION", "us-east-1")
+
+# Lifetime of a direct-upload presigned POST (seconds). Kept short because the
+# key prefix is stamped when the POST is signed.
+DIRECT_UPLOAD_URL_EXPIRATION = int(os.getenv("DIRECT_UPLOAD_URL_EXPIRATION", "600"))
+
+# Longest a get-insights call may run before its metadata is written (seconds)
+INSIGHTS_MAX_TIMEOUT = 600
+
+DEFAULT_USER_ID = 101
+DEFAULT_ORG_ID = 101
+DEFAULT_TAG_ID = 123
+DEFAULT_CI_ORG_GUID = "880f867a-1168-4905-a3bc-30257f2cc91f"
+
+# Files per transaction for bulk registration
+DB_INSERT_BATCH_SIZE = int(os.getenv("DB_INSERT_BATCH_SIZE", "500"))
+
+# ------------------------------
+# CLIENTS
+# ------------------------------
+def new_s3_client():
+    """Create an S3 client."""
+    return boto3.client(
+        "s3",
+        region_name=AWS_REGION,
+        aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
+        aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY")
+    )
+
+def get_db_connection():
+    """Create database connection."""
+    return pymysql.connect(
+        host=os.getenv("DB_HOST"),
+        user=os.getenv("DB_USER"),
+        password=os.getenv("DB_PASSWORD"),
+        database=os.getenv("DB_NAME"),
+        cursorclass=pymysql.cursors.DictCursor,
+        autocommit=False
+    )
+
+# ------------------------------
+# REGISTRATION
+# ------------------------------
+FILES_INSERT_SQL = """
+    INSERT INTO files
+        (name, user_id, upload_state, file_size,
+         ci_file_guid, ci_org_guid, type, status,
+         is_contract, is_template)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+"""
+
+FILE_TAGS_INSERT_SQL = """
+    INSERT INTO file_tags (file_temp_id, tag_id)
+    VALUES (%s, %s)
+"""
+
+def sql_for(sql, placeholder):
+    """Rewrite %s placeholders for drivers with another paramstyle."""
+    return sql if placeholder == "%s" else sql.replace("%s", placeholder)
+
+def file_row(file_info):
+    """Values for a files row."""
+    return (
+        file_info["file_name"],
+        file_info["user_id"],
+        3,
+        file_info["file_size"],
+        file_info["file_id"],
+        DEFAULT_CI_ORG_GUID,
+        1,
+        1,
+        1,
+        0
+    )
+
+def file_tag_row(file_info):
+    """Values for a file_tags row."""
+    return (file_info["file_id"], file_info.get("tag_id", DEFAULT_TAG_ID))
+
+def insert_file(cursor, file_info, placeholder="%s"):
+    """Insert one file and its tag using an open cursor."""
+    cursor.execute(sql_for(FILES_INSERT_SQL, placeholder), file_row(file_info))
+    cursor.execute(sql_for(FILE_TAGS_INSERT_SQL, placeholder), file_tag_row(file_info))
+
+def insert_files_batched(conn, file_infos, batch_size=DB_INSERT_BATCH_SIZE, placeholder="%s"):
+    """Insert many files and their tags, one transaction per batch.
+
+    Each batch is written with executemany. If a batch fails, it is replayed
+    row by row inside a single transaction, with a savepoint per row, so one
+    bad row only loses itself. Returns (stored_file_ids, failures) where
+    failures maps file_id to an error message.
+    """
+    files_sql = sql_for(FILES_INSERT_SQL, placeholder)
+    tags_sql = sql_for(FILE_TAGS_INSERT_SQL, placeholder)
+    stored, failures = [], {}
+
+    for start in range(0, len(file_infos), batch_size):
+        batch = file_infos[start:start + batch_size]
+        cursor = conn.cursor()
+        try:
+            cursor.executemany(files_sql, [file_row(f) for f in batch])
+            cursor.executemany(tags_sql, [file_tag_row(f) for f in batch])
+            conn.commit()
+            stored.extend(f["file_id"] for f in batch)
+            continue
+        except Exception:
+            conn.rollback()
+        finally:
+            cursor.close()
+
+        # Isolate the failing rows without giving up on the rest of the batch
+        cursor = conn.cursor()
+        batch_stored = []
+        try:
+            for file_info in batch:
+                cursor.execute("SAVEPOINT file_row")
+                try:
+                    insert_file(cursor, file_info, placeholder)
+                    cursor.execute("RELEASE SAVEPOINT file_row")
+                    batch_stored.append(file_info["file_id"])
+                except Exception as e:
+                    cursor.execute("ROLLBACK TO SAVEPOINT file_row")
+                    cursor.execute("RELEASE SAVEPOINT file_row")
+                    failures[file_info["file_id"]] = str(e)
+            conn.commit()
+            stored.extend(batch_stored)
+        except Exception as e:
+            # The whole batch rolled back, including rows not tried yet
+            conn.rollback()
+            for file_info in batch:
+                failures.setdefault(file_info["file_id"], str(e))
+        finally:
+            cursor.close()
+
+    return stored, failures
+
+def find_existing_file_ids(conn, file_ids, batch_size=DB_INSERT_BATCH_SIZE):
+    """Return the subset of file_ids that have a files row."""
+    file_ids = list(file_ids)
+    existing = set()
+    for start in range(0, len(file_ids), batch_size):
+        batch = file_ids[start:start + batch_size]
+        placeholders = ", ".join(["%s"] * len(batch))
+        with conn.cursor() as cursor:
+            cursor.execute(
+                f"SELECT ci_file_guid FROM files WHERE ci_file_guid IN ({placeholders})",
+                batch
+            )
+            existing.update(row["ci_file_guid"] for row in cursor.fetchall())
+    return existing
+
+def store_files_batched(file_infos, batch_size=DB_INSERT_BATCH_SIZE):
+    """Register the files that have no files row yet, over one MySQL connection.
+
+    files.ci_file_guid is not guaranteed to be unique, so files that are
+    already registered (or repeated in file_infos) are skipped rather than
+    inserted twice. Returns (stored_file_ids, failures) like
+    insert_files_batched; skipped files appear in neither.
+    """
+    conn = None
+    try:
+        conn = get_db_connection()
+        unique_infos = list({f["file_id"]: f for f in file_infos}.values())
+        existing = find_existing_file_ids(conn, [f["file_id"] for f in unique_infos], batch_size)
+        missing = [f for f in unique_infos if f["file_id"] not in existing]
+        return insert_files_batched(conn, missing, batch_size)
+    except Exception as e:
+        return [], {f["file_id"]: str(e) for f in file_infos}
+    finally:
+        if conn:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+def main():
+    parser = argparse.ArgumentParser(description="Register file metadata in MySQL in batches.")
+    parser.add_argument("path", help="JSON list of file entries, e.g. data/uploaded_files.json")
+    parser.add_argument("--batch-size", type=int, default=DB_INSERT_BATCH_SIZE)
+    args = parser.parse_args()
+
+    with open(args.path, "r") as f:
+        file_infos = json.load(f)
+    stored, failures = store_files_batched(file_infos, args.batch_size)
+    print(json.dumps({
+        "stored": len(stored),
+        "skipped": len({f["file_id"] for f in file_infos}) - len(stored) - len(failures),
+        "failures": failures
+    }, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,362 @@
+"""Reconcile local metadata, MySQL, S3 and the vector store.
+
+Finds drift between data/uploaded_files.json (plus pending insight jobs),
+the MySQL files/file_tags tables, the uploads/ prefix of the S3 bucket and
+the vector store, then reports it or repairs it in batches.
+
+Runs are incremental. S3 keys are uploads/<timestamp>_<name>, so they list in
+upload order and a StartAfter watermark skips everything already reconciled.
+DB rows are read with keyset pagination on files.id. Deletions that fail are
+kept in the state file and retried on the next repair run. State lives in
+data/reconcile_state.json.
+
+The bucket and the files table are shared with other instances, so objects
+and rows missing from this instance's metadata are only reported unless
+--repair-orphans says this instance owns them. Only that flag advances the
+watermarks, so unrepaired orphans are reported again. Only this app's user
+(DEFAULT_USER_ID) is scanned in the DB.
+
+Usage:
+    python reconcile.py                     # report drift since the watermark
+    python reconcile.py --repair            # remove stale metadata and its DB rows/vectors
+    python reconcile.py --repair-orphans    # also delete orphaned S3 objects, DB rows and vectors
+    python reconcile.py --full              # ignore the watermark
+"""
+import argparse
+import json
+import math
+import os
+from datetime import datetime, timedelta
+
+import requests
+from botocore.exceptions import ClientError
+
+from file_registry import (
+    DATA_STORE, DEFAULT_CI_ORG_GUID, DEFAULT_ORG_ID, DEFAULT_USER_ID,
+    DELETE_FILE_API, DIRECT_UPLOAD_URL_EXPIRATION, INSIGHT_JOBS_FILE,
+    INSIGHTS_MAX_TIMEOUT, RECONCILE_STATE_FILE, S3_BUCKET_NAME, S3_UPLOAD_PREFIX,
+    find_existing_file_ids, get_db_connection, new_s3_client
+)
+
+# ------------------------------
+# CONFIGURATION
+# ------------------------------
+RECONCILE_BATCH_SIZE = 500
+S3_DELETE_BATCH_SIZE = 1000  # DeleteObjects limit
+# Uploads (S3 objects and DB rows) younger than this may still be in flight
+# and are not judged yet. A direct-upload key is stamped when its POST is
+# signed, the browser may upload until the POST expires, and the metadata is
+# written once insights return, so the grace never drops below that.
+RECONCILE_MIN_GRACE_MINUTES = math.ceil((DIRECT_UPLOAD_URL_EXPIRATION + INSIGHTS_MAX_TIMEOUT) / 60)
+RECONCILE_GRACE_MINUTES = max(
+    RECONCILE_MIN_GRACE_MINUTES,
+    int(os.getenv("RECONCILE_GRACE_MINUTES", "60"))
+)
+
+# ------------------------------
+# STATE
+# ------------------------------
+def load_json(path, default):
+    """Load a JSON file, returning default if it is missing or unreadable."""
+    try:
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                return json.load(f)
+    except Exception as e:
+        print(f"[RECONCILE] Error loading {path}: {e}")
+    return default
+
+def save_json(path, data):
+    """Save data as JSON."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(data, f, indent=4)
+
+def load_state():
+    """Load the reconciliation watermark."""
+    state = {
+        "s3_after_key": "",
+        "db_after_id": 0,
+        # (max files.id, time observed) pairs; rows up to a snapshot's id are
+        # at least as old as the snapshot
+        "db_snapshots": [],
+        # Deletions that failed on an earlier repair run
+        "retry_s3_keys": [],
+        "retry_db_file_ids": [],
+        "retry_vector_file_ids": [],
+        "last_run": None
+    }
+    state.update(load_json(RECONCILE_STATE_FILE, {}))
+    # Replaced by db_snapshots
+    state.pop("db_pending_max_id", None)
+    return state
+
+# ------------------------------
+# HELPERS
+# ------------------------------
+def chunked(items, size):
+    """Yield successive lists of at most size items."""
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+# ------------------------------
+# SCANNING
+# ------------------------------
+def iter_s3_keys(s3_client, start_after, stop_before, page_size):
+    """Yield upload keys after start_after and before stop_before, in order."""
+    params = {
+        "Bucket": S3_BUCKET_NAME,
+        "Prefix": S3_UPLOAD_PREFIX,
+        "PaginationConfig": {"PageSize": page_size}
+    }
+    if start_after:
+        params["StartAfter"] = start_after
+
+    paginator = s3_client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(**params):
+        for obj in page.get("Contents", []):
+            if obj["Key"] >= stop_before:
+                return
+            yield obj["Key"]
+
+def get_max_file_id(conn):
+    """Return the highest files.id for this org and user."""
+    with conn.cursor() as cursor:
+        cursor.execute(
+            "SELECT MAX(id) AS max_id FROM files WHERE ci_org_guid = %s AND user_id = %s",
+            (DEFAULT_CI_ORG_GUID, DEFAULT_USER_ID)
+        )
+        return cursor.fetchone()["max_id"] or 0
+
+def iter_db_files(conn, after_id, until_id, batch_size):
+    """Yield pages of (id, ci_file_guid) rows using keyset pagination."""
+    sql = """
+        SELECT id, ci_file_guid FROM files
+        WHERE ci_org_guid = %s AND user_id = %s AND id > %s AND id <= %s
+        ORDER BY id
+        LIMIT %s
+    """
+    while after_id < until_id:
+        with conn.cursor() as cursor:
+            cursor.execute(sql, (DEFAULT_CI_ORG_GUID, DEFAULT_USER_ID, after_id, until_id, batch_size))
+            rows = cursor.fetchall()
+        if not rows:
+            return
+        yield rows
+        after_id = rows[-1]["id"]
+
+# ------------------------------
+# REPAIRS
+# ------------------------------
+def delete_s3_objects(s3_client, keys, errors):
+    """Delete S3 objects in DeleteObjects batches. Returns the keys that failed."""
+    failed = []
+    for batch in chunked(keys, S3_DELETE_BATCH_SIZE):
+        try:
+            response = s3_client.delete_objects(
+                Bucket=S3_BUCKET_NAME,
+                Delete={"Objects": [{"Key": key} for key in batch], "Quiet": True}
+            )
+            for e in response.get("Errors", []):
+                errors.append(f"S3 delete {e['Key']}: {e.get('Message')}")
+                failed.append(e["Key"])
+        except ClientError as e:
+            errors.append(f"S3 delete batch failed: {e}")
+            failed.extend(batch)
+    return failed
+
+def delete_db_files(conn, file_ids, batch_size, errors):
+    """Delete files/file_tags rows, one transaction per batch. Returns the ids that failed."""
+    failed = []
+    for batch in chunked(file_ids, batch_size):
+        placeholders = ", ".join(["%s"] * len(batch))
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(f"DELETE FROM file_tags WHERE file_temp_id IN ({placeholders})", batch)
+                cursor.execute(f"DELETE FROM files WHERE ci_file_guid IN ({placeholders})", batch)
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            errors.append(f"DB delete batch failed: {e}")
+            failed.extend(batch)
+    return failed
+
+def remove_vectors(file_ids, batch_size, errors):
+    """Remove vectors via the delete-files API in batches. Returns the ids that failed."""
+    failed = []
+    for batch in chunked(file_ids, batch_size):
+        payload = {
+            "user_id": DEFAULT_USER_ID,
+            "org_id": DEFAULT_ORG_ID,
+            "file_ids": batch
+        }
+        try:
+            response = requests.post(DELETE_FILE_API, json=payload, timeout=220)
+            if response.status_code != 200:
+                errors.append(f"Vector delete returned {response.status_code}: {response.text[:200]}")
+                failed.extend(batch)
+        except Exception as e:
+            errors.append(f"Vector delete batch failed: {e}")
+            failed.extend(batch)
+    return failed
+
+def unique(items):
+    """De-duplicate while keeping order."""
+    return list(dict.fromkeys(items))
+
+# ------------------------------
+# RECONCILE
+# ------------------------------
+def reconcile(repair=False, repair_orphans=False, full=False, batch_size=RECONCILE_BATCH_SIZE):
+    """Diff all stores since the watermark and optionally repair. Returns a report.
+
+    repair removes this instance's stale metadata with its DB rows and
+    vectors; repair_orphans additionally deletes S3 objects, DB rows and
+    vectors that no metadata entry references.
+    """
+    state = load_state()
+    s3_after_key = "" if full else state["s3_after_key"]
+    db_after_id = 0 if full else state["db_after_id"]
+
+    # Local metadata is small; pending insight jobs are tracked, not orphans
+    metadata = load_json(DATA_STORE, [])
+    jobs = load_json(INSIGHT_JOBS_FILE, {})
+    known = {f["file_id"]: f for f in metadata}
+    known.update({file_id: job["file_info"] for file_id, job in jobs.items()})
+
+    now = datetime.now()
+    cutoff = now - timedelta(minutes=RECONCILE_GRACE_MINUTES)
+    stop_before = S3_UPLOAD_PREFIX + cutoff.strftime("%Y%m%d_%H%M%S")
+
+    # Metadata entries whose key falls in this run's S3 window
+    key_to_file_id = {f["s3_key"]: file_id for file_id, f in known.items() if f.get("s3_key")}
+    unseen_keys = {key for key in key_to_file_id if s3_after_key < key < stop_before}
+    window_file_ids = [key_to_file_id[key] for key in unseen_keys]
+
+    report = {
+        "s3_scanned": 0,
+        "db_scanned": 0,
+        "orphan_s3_keys": [],
+        "orphan_db_file_ids": [],
+        "metadata_missing_s3": [],
+        "metadata_missing_db": [],
+        "pending_retries": {},
+        "repaired": {},
+        "errors": []
+    }
+
+    # Deletions that failed on an earlier run, unless the entry came back
+    retry_s3_keys = [k for k in state["retry_s3_keys"] if k not in key_to_file_id]
+    retry_db_ids = [i for i in state["retry_db_file_ids"] if i not in known]
+    retry_vector_ids = [i for i in state["retry_vector_file_ids"] if i not in known]
+
+    report["pending_retries"] = {
+        "s3_keys": len(retry_s3_keys),
+        "db_file_ids": len(retry_db_ids),
+        "vector_file_ids": len(retry_vector_ids)
+    }
+
+    # S3: objects nobody references
+    s3_client = new_s3_client()
+    last_key = s3_after_key
+    for key in iter_s3_keys(s3_client, s3_after_key, stop_before, batch_size):
+        report["s3_scanned"] += 1
+        last_key = key
+        if key in unseen_keys:
+            unseen_keys.discard(key)
+        else:
+            report["orphan_s3_keys"].append(key)
+    report["metadata_missing_s3"] = sorted(key_to_file_id[key] for key in unseen_keys)
+
+    conn = get_db_connection()
+    try:
+        # DB: only rows that already existed RECONCILE_GRACE_MINUTES ago are
+        # judged, since an upload's row is written before its metadata.
+        snapshots = state["db_snapshots"] + [
+            {"max_id": get_max_file_id(conn), "taken_at": now.isoformat()}
+        ]
+        ripe = [s for s in snapshots if datetime.fromisoformat(s["taken_at"]) <= cutoff]
+        unripe = [s for s in snapshots if datetime.fromisoformat(s["taken_at"]) > cutoff]
+        db_until_id = max((s["max_id"] for s in ripe), default=0)
+        # The newest ripe snapshot is all later runs still need
+        snapshots = ripe[-1:] + unripe
+
+        for rows in iter_db_files(conn, db_after_id, db_until_id, batch_size):
+            report["db_scanned"] += len(rows)
+            report["orphan_db_file_ids"].extend(
+                row["ci_file_guid"] for row in rows if row["ci_file_guid"] not in known
+            )
+
+        existing = find_existing_file_ids(conn, window_file_ids, batch_size)
+        report["metadata_missing_db"] = sorted(set(window_file_ids) - existing)
+
+        new_state = {**state, "db_snapshots": snapshots}
+        if repair or repair_orphans:
+            errors = report["errors"]
+            s3_keys = unique(retry_s3_keys + (report["orphan_s3_keys"] if repair_orphans else []))
+            failed_keys = delete_s3_objects(s3_client, s3_keys, errors)
+            report["repaired"]["s3_objects"] = len(s3_keys) - len(failed_keys)
+
+            # Entries whose document is gone from S3 can no longer be queried
+            stale_ids = report["metadata_missing_s3"]
+            if stale_ids:
+                remaining = [f for f in metadata if f["file_id"] not in stale_ids]
+                save_json(DATA_STORE, remaining)
+                for file_id in stale_ids:
+                    jobs.pop(file_id, None)
+                save_json(INSIGHT_JOBS_FILE, jobs)
+            report["repaired"]["metadata_entries"] = len(stale_ids)
+
+            # Stale entries were this instance's own, so their rows go too
+            dead_ids = unique(
+                stale_ids + retry_db_ids + (report["orphan_db_file_ids"] if repair_orphans else [])
+            )
+            failed_db_ids = delete_db_files(conn, dead_ids, batch_size, errors)
+            report["repaired"]["db_rows"] = len(dead_ids) - len(failed_db_ids)
+
+            vector_ids = unique(dead_ids + retry_vector_ids)
+            failed_vector_ids = remove_vectors(vector_ids, batch_size, errors)
+            report["repaired"]["vectors"] = len(vector_ids) - len(failed_vector_ids)
+
+            new_state.update({
+                "retry_s3_keys": failed_keys,
+                "retry_db_file_ids": failed_db_ids,
+                "retry_vector_file_ids": failed_vector_ids,
+                "last_run": now.isoformat()
+            })
+            if repair_orphans:
+                # Without repair_orphans the orphans were left alone, so the
+                # watermarks stay put and they are reported again.
+                new_state.update({
+                    "s3_after_key": last_key,
+                    "db_after_id": max(db_after_id, db_until_id)
+                })
+        save_json(RECONCILE_STATE_FILE, new_state)
+    finally:
+        conn.close()
+
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description="Reconcile metadata, MySQL, S3 and vectors.")
+    parser.add_argument("--repair", action="store_true", help="remove stale metadata and its DB rows and vectors")
+    parser.add_argument(
+        "--repair-orphans",
+        action="store_true",
+        help="also delete S3 objects, DB rows and vectors missing from this instance's metadata"
+    )
+    parser.add_argument("--full", action="store_true", help="ignore the watermark and scan everything")
+    parser.add_argument("--batch-size", type=int, default=RECONCILE_BATCH_SIZE)
+    args = parser.parse_args()
+
+    report = reconcile(
+        repair=args.repair,
+        repair_orphans=args.repair_orphans,
+        full=args.full,
+        batch_size=args.batch_size
+    )
+    print(json.dumps(report, indent=4))
+
+if __name__ == "__main__":
+    main()